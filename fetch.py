@@ -1,15 +1,28 @@
 import abc
+import base64
+import gzip
+import http
+import http.client
 import logging
+import threading
+import urllib.error
+import urllib.parse
 import urllib.request
 
+from typing import Dict, Optional, Tuple
+
 import prometheus_client    # type: ignore[import]
 
 
 
 # Metrics
-LATENCY = prometheus_client.Summary(
+# A Histogram rather than a Summary: the Python client's Summary exports only
+# a count and sum, whereas buckets give the latency distribution. The buckets
+# run up to TIMEOUT.
+LATENCY = prometheus_client.Histogram(
   'gtfs_request_latency_seconds',
-  'Request latency to GTFS API service')
+  'Request latency to GTFS API service',
+  buckets=(.05, .1, .25, .5, 1, 2.5, 5, 10, 30))
 
 RESPONSE_BYTES = prometheus_client.Summary(
   'gtfs_response_bytes',
@@ -25,29 +38,199 @@ REQUESTS = prometheus_client.Counter(
   'Requests to GTFS API service')
 
 
+# RESPONSE_STATUS children by status code. labels() stringifies and locks on
+# every call; nearly every response is one of a few codes.
+_STATUS_COUNTERS : Dict[int, prometheus_client.Counter] = {}
+
+
+def _StatusCounter(code: int) -> prometheus_client.Counter:
+  counter = _STATUS_COUNTERS.get(code, None)
+  if counter is None:
+    counter = _STATUS_COUNTERS.setdefault(code, RESPONSE_STATUS.labels(code))
+  return counter
+
+
+# Seconds to wait on the GTFS API before giving up.
+TIMEOUT = 30
+
+# Redirects to follow before giving up on a request.
+MAX_REDIRECTS = 5
+
+# How a kept-alive connection the server has since closed fails on reuse.
+# (RemoteDisconnected is a ConnectionResetError; listed for clarity.)
+_STALE_CONNECTION_ERRORS = (
+  http.client.RemoteDisconnected,
+  ConnectionResetError,
+  ConnectionAbortedError,
+  BrokenPipeError,
+)
+
+_REDIRECT_STATUSES = frozenset([
+  http.HTTPStatus.MOVED_PERMANENTLY,
+  http.HTTPStatus.FOUND,
+  http.HTTPStatus.SEE_OTHER,
+  http.HTTPStatus.TEMPORARY_REDIRECT,
+  http.HTTPStatus.PERMANENT_REDIRECT,
+])
+
+
 class Fetcher(abc.ABC):
+  """Fetches GTFS-R data over a persistent (keep-alive) connection.
+
+  The feed is polled frequently; reusing one connection avoids a TCP and TLS
+  handshake on every poll. Requests are conditional on the last response's
+  validators, so an unchanged feed comes back as a bodiless 304.
+  """
+  # Provider name, for logging.
+  NAME : str
+
+  def __init__(self):
+    self._conn : Optional[http.client.HTTPConnection] = None
+    # (scheme, netloc) that _conn talks to.
+    self._origin : Optional[Tuple[str, str]] = None
+    # Set when _conn is to a plain HTTP proxy, which wants absolute URLs.
+    self._proxy_headers : Optional[Dict[str, str]] = None
+    self._lock = threading.Lock()
+    self._etag : Optional[str] = None
+    self._last_modified : Optional[str] = None
+    self._last_body = b''
+
   def request(self) -> urllib.request.Request:
     pass
 
+  def _Connect(self, url: urllib.parse.SplitResult) -> http.client.HTTPConnection:
+    """Connects to url's host, or to its proxy as urllib would choose it."""
+    self._proxy_headers = None
+    proxy = urllib.request.getproxies().get(url.scheme)
+    if not proxy or urllib.request.proxy_bypass(url.netloc):
+      if url.scheme == 'http':
+        return http.client.HTTPConnection(url.netloc, timeout=TIMEOUT)
+      return http.client.HTTPSConnection(url.netloc, timeout=TIMEOUT)
+
+    if '://' not in proxy:
+      proxy = 'http://' + proxy
+    p = urllib.parse.urlsplit(proxy)
+    headers = {}
+    if p.username is not None:
+      creds = '%s:%s' % (urllib.parse.unquote(p.username), urllib.parse.unquote(p.password or ''))
+      headers['Proxy-Authorization'] = 'Basic ' + base64.b64encode(creds.encode()).decode('ascii')
+    proxy_host = p.netloc.rpartition('@')[2]
+
+    if url.scheme == 'http':
+      self._proxy_headers = headers
+      return http.client.HTTPConnection(proxy_host, timeout=TIMEOUT)
+    conn = http.client.HTTPSConnection(proxy_host, timeout=TIMEOUT)
+    conn.set_tunnel(url.netloc, headers=headers)
+    return conn
+
+  def _Disconnect(self) -> None:
+    conn, self._conn = self._conn, None
+    if conn is not None:
+      conn.close()
+
+  def _Request(self, url: urllib.parse.SplitResult, headers: Dict[str, str]) -> http.client.HTTPResponse:
+    origin = (url.scheme, url.netloc)
+    if self._origin != origin:
+      self._Disconnect()
+    conn = self._conn
+    if conn is None:
+      conn = self._conn = self._Connect(url)
+      self._origin = origin
+
+    if self._proxy_headers is not None:
+      path = urllib.parse.urlunsplit(url._replace(fragment=''))
+      headers = dict(headers, **self._proxy_headers)
+    else:
+      path = urllib.parse.urlunsplit(('', '', url.path or '/', url.query, ''))
+    try:
+      conn.request('GET', path, headers=headers)
+      return conn.getresponse()
+    except (http.client.HTTPException, OSError):
+      self._Disconnect()
+      raise
+
+  def _RequestWithRetry(self, url: urllib.parse.SplitResult, headers: Dict[str, str]) -> http.client.HTTPResponse:
+    # The server may have closed an idle connection since the last poll;
+    # if a reused connection turns out to be closed, retry once on a fresh
+    # one. Anything else, notably a timeout, would only fail again.
+    reused = self._conn is not None and self._origin == (url.scheme, url.netloc)
+    try:
+      return self._Request(url, headers)
+    except _STALE_CONNECTION_ERRORS:
+      if not reused:
+        raise
+
+    return self._Request(url, headers)
+
+  def _Get(self, req: urllib.request.Request) -> http.client.HTTPResponse:
+    url = urllib.parse.urlsplit(req.full_url)
+    headers = dict(req.header_items())
+    headers['Accept-Encoding'] = 'gzip'
+    if self._etag:
+      headers['If-None-Match'] = self._etag
+    if self._last_modified:
+      headers['If-Modified-Since'] = self._last_modified
+
+    for _ in range(MAX_REDIRECTS):
+      resp = self._RequestWithRetry(url, headers)
+      location = resp.getheader('Location')
+      if resp.status not in _REDIRECT_STATUSES or not location:
+        return resp
+
+      # Drain the redirect so the connection can be reused.
+      resp.read()
+      if resp.will_close:
+        self._Disconnect()
+      _StatusCounter(resp.status).inc()
+      url = urllib.parse.urlsplit(
+        urllib.parse.urljoin(urllib.parse.urlunsplit(url), location))
+
+    return self._RequestWithRetry(url, headers)
+
   @LATENCY.time()
   def Fetch(self) -> bytes:
     """Fetches the GTFS data"""
     REQUESTS.inc()
 
     req = self.request()
-    with urllib.request.urlopen(req) as f:
-      out = f.read()
-      RESPONSE_STATUS.labels(f.status).inc()
+    with self._lock:
+      resp = self._Get(req)
+      if resp.getheader('Content-Encoding') == 'gzip':
+        # Decompress as the body arrives, rather than holding both the
+        # compressed and decompressed feed in memory.
+        out = gzip.GzipFile(fileobj=resp).read()
+      else:
+        out = resp.read()
+      _StatusCounter(resp.status).inc()
+
+      if resp.will_close:
+        self._Disconnect()
+
+      RESPONSE_BYTES.observe(len(out))
+
+      if resp.status == http.HTTPStatus.NOT_MODIFIED:
+        return self._last_body
+
+      # Anything else that isn't a 2xx -- including a redirect we couldn't
+      # or wouldn't follow -- has no feed in its body.
+      if resp.status >= 300:
+        raise urllib.error.HTTPError(req.full_url, resp.status, resp.reason,
+          resp.headers, None)
+
+      self._etag = resp.getheader('ETag')
+      self._last_modified = resp.getheader('Last-Modified')
+      self._last_body = out
 
-    RESPONSE_BYTES.observe(len(out))
     return out
 
 
 class IrelandNTA(Fetcher):
+  NAME = "Irish NTA"
   TEST_URL = "https://api.nationaltransport.ie/gtfsrtest/"
   PROD_URL = "https://api.nationaltransport.ie/gtfsr/v2/TripUpdates"
 
   def __init__(self, api_key: str, url: str):
+    super().__init__()
     self.api_key = api_key
     self.url = url
 
@@ -60,11 +243,13 @@ class IrelandNTA(Fetcher):
   
 
 class VicRoads(Fetcher):
+  NAME = "VicRoads/PTV"
   METROBUS_URL = "https://data-exchange-api.vicroads.vic.gov.au/opendata/v1/gtfsr/metrobus-tripupdates"
   METROTRAIN_URL = "https://data-exchange-api.vicroads.vic.gov.au/opendata/v1/gtfsr/metrotrain-tripupdates"
   YARRATRAMS_URL = "https://data-exchange-api.vicroads.vic.gov.au/opendata/gtfsr/v1/tram/tripupdates"
 
   def __init__(self, api_key: str, url: str):
+    super().__init__()
     self.api_key = api_key
     self.url = url
 
@@ -77,26 +262,30 @@ class VicRoads(Fetcher):
     return urllib.request.Request(self.url, None, headers)
   
 
+# (provider, env) -> (Fetcher, URL).
+FETCHERS = {
+  ('nta', 'prod'): (IrelandNTA, IrelandNTA.PROD_URL),
+  ('nta', 'test'): (IrelandNTA, IrelandNTA.TEST_URL),
+  ('vicroads', 'metrobus'): (VicRoads, VicRoads.METROBUS_URL),
+  ('vicroads', 'metrotrain'): (VicRoads, VicRoads.METROTRAIN_URL),
+  ('vicroads', 'tram'): (VicRoads, VicRoads.YARRATRAMS_URL),
+}
+
+# Env used for a provider when the requested env isn't one of its own.
+DEFAULT_ENVS = {
+  'nta': 'test',
+}
+
+
 def MakeFetcher(provider: str, env: str, api_key: str) -> Fetcher:
-  if provider == "nta":
-    url = IrelandNTA.TEST_URL
-    if env == 'prod':
-      url = IrelandNTA.PROD_URL
-
-    logging.info("Irish NTA, env=%s, url=%s", env, url)
-    return IrelandNTA(api_key, url)
-  elif provider == "vicroads":
-    if env == 'metrobus':
-      url = VicRoads.METROBUS_URL
-    elif env == 'metrotrain':
-      url = VicRoads.METROTRAIN_URL
-    elif env == 'tram':
-      url = VicRoads.YARRATRAMS_URL
-    else:
-      logging.error("Unknown VicRoads/PTV env %s", env)
-      return None
-    
-    logging.info("VicRoads/PTV, env=%s, url=%s", env, url)
-    return VicRoads(api_key, url)
-  
-  return None
\ No newline at end of file
+  if (provider, env) in FETCHERS:
+    cls, url = FETCHERS[(provider, env)]
+  elif provider in DEFAULT_ENVS:
+    cls, url = FETCHERS[(provider, DEFAULT_ENVS[provider])]
+  else:
+    if any(p == provider for p, _ in FETCHERS):
+      logging.error("Unknown %s env %s", provider, env)
+    return None
+
+  logging.info("%s, env=%s, url=%s", cls.NAME, env, url)
+  return cls(api_key, url)
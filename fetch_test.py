@@ -0,0 +1,164 @@
+import fetch
+
+import gzip
+import http.server
+import os
+import socket
+import threading
+import unittest
+import unittest.mock
+import urllib.error
+import urllib.request
+
+FEED = b'feed' * 100
+ETAG = '"v1"'
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+  protocol_version = 'HTTP/1.1'
+
+  def do_GET(self):
+    self.server.requests.append((self.client_address, self.path))
+    path = self.path.rpartition('/')[2]
+
+    if path == 'feed':
+      self.SendFeed()
+    elif path == 'drop':
+      # Answer, then drop the connection without telling the client.
+      self.SendFeed()
+      self.close_connection = True
+    elif path == 'stall':
+      self.server.release.wait(5)
+      self.SendEmpty(204)
+    elif path == 'moved':
+      self.SendEmpty(302, Location='/feed')
+    elif path == 'loop':
+      self.SendEmpty(302, Location='/loop')
+    elif path == 'nowhere':
+      self.SendEmpty(302)
+    else:
+      self.SendEmpty(403)
+
+  def SendFeed(self):
+    if self.headers.get('If-None-Match') == ETAG:
+      self.SendEmpty(304)
+      return
+
+    body = gzip.compress(FEED)
+    self.send_response(200)
+    self.send_header('Content-Encoding', 'gzip')
+    self.send_header('Content-Length', str(len(body)))
+    self.send_header('ETag', ETAG)
+    self.end_headers()
+    self.wfile.write(body)
+
+  def SendEmpty(self, code, **headers):
+    self.send_response(code)
+    for k, v in headers.items():
+      self.send_header(k, v)
+    self.send_header('Content-Length', '0')
+    self.end_headers()
+
+  def log_message(self, *args):
+    pass
+
+
+class TestFetcher(fetch.Fetcher):
+  def __init__(self, url: str):
+    super().__init__()
+    self.url = url
+
+  def request(self):
+    return urllib.request.Request(self.url)
+
+
+class TestFetch(unittest.TestCase):
+  def setUp(self):
+    # Keep any proxy in the environment out of the way.
+    env = {k: v for k, v in os.environ.items() if not k.lower().endswith('_proxy')}
+    patcher = unittest.mock.patch.dict(os.environ, env, clear=True)
+    patcher.start()
+    self.addCleanup(patcher.stop)
+
+    self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    self.server.daemon_threads = True
+    self.server.requests = []
+    thread = threading.Thread(target=self.server.serve_forever, args=(0.01,), daemon=True)
+    thread.start()
+    self.server.release = threading.Event()
+    self.addCleanup(self.server.server_close)
+    self.addCleanup(self.server.shutdown)
+    self.addCleanup(self.server.release.set)
+
+  def makeFetcher(self, path: str) -> fetch.Fetcher:
+    f = TestFetcher('http://127.0.0.1:%d/%s' % (self.server.server_address[1], path))
+    self.addCleanup(f._Disconnect)
+    return f
+
+  def connections(self):
+    return len(set(addr for addr, _ in self.server.requests))
+
+  def testFetchGzip(self):
+    f = self.makeFetcher('feed')
+    self.assertEqual(f.Fetch(), FEED)
+
+  def testNotModifiedReturnsLastBody(self):
+    f = self.makeFetcher('feed')
+    first = f.Fetch()
+    self.assertIs(f.Fetch(), first)
+    self.assertEqual(len(self.server.requests), 2)
+    self.assertEqual(self.connections(), 1)
+
+  def testClientError(self):
+    f = self.makeFetcher('forbidden')
+    with self.assertRaises(urllib.error.HTTPError) as cm:
+      f.Fetch()
+    self.assertEqual(cm.exception.code, 403)
+
+  def testRetryAfterServerCloses(self):
+    f = self.makeFetcher('drop')
+    self.assertEqual(f.Fetch(), FEED)
+    self.assertEqual(f.Fetch(), FEED)
+    self.assertEqual(self.connections(), 2)
+
+  def testNoRetryAfterTimeout(self):
+    f = self.makeFetcher('feed')
+    self.assertEqual(f.Fetch(), FEED)
+
+    # A stalled server won't do any better on a new connection.
+    f.url = f.url.replace('/feed', '/stall')
+    f._conn.sock.settimeout(0.1)
+    with self.assertRaises(socket.timeout):
+      f.Fetch()
+    self.assertEqual([p for _, p in self.server.requests], ['/feed', '/stall'])
+
+  def testFollowsRedirect(self):
+    f = self.makeFetcher('moved')
+    self.assertEqual(f.Fetch(), FEED)
+    self.assertEqual([p for _, p in self.server.requests], ['/moved', '/feed'])
+    self.assertEqual(self.connections(), 1)
+
+  def testRedirectLoop(self):
+    f = self.makeFetcher('loop')
+    with self.assertRaises(urllib.error.HTTPError) as cm:
+      f.Fetch()
+    self.assertEqual(cm.exception.code, 302)
+    self.assertEqual(len(self.server.requests), fetch.MAX_REDIRECTS + 1)
+
+  def testRedirectWithoutLocation(self):
+    f = self.makeFetcher('nowhere')
+    with self.assertRaises(urllib.error.HTTPError) as cm:
+      f.Fetch()
+    self.assertEqual(cm.exception.code, 302)
+    self.assertEqual(f._last_body, b'')
+
+  def testHTTPProxy(self):
+    os.environ['http_proxy'] = 'http://127.0.0.1:%d' % self.server.server_address[1]
+    f = TestFetcher('http://gtfs.example/feed')
+    self.addCleanup(f._Disconnect)
+    self.assertEqual(f.Fetch(), FEED)
+    self.assertEqual([p for _, p in self.server.requests], ['http://gtfs.example/feed'])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -1,10 +1,16 @@
 import gtfs_data.loader
 
+import array
+import bisect
 import collections
+import concurrent.futures
 import datetime
+import functools
 import logging
+import operator
 import os
-from typing import AbstractSet, Any, List, Dict, NamedTuple
+import sys
+from typing import AbstractSet, Any, List, Dict, NamedTuple, Optional, Sequence, Tuple, overload
 
 import prometheus_client    # type: ignore[import]
 
@@ -27,6 +33,16 @@ SCHEDULE_RESPONSE  = prometheus_client.Summary(
   'gtfs_schedule_returned_trips',
   'Response sizes for GetSchedule()')
 
+# The hit rate is 1 - misses/lookups. Misses are counted where the cache calls
+# through, as lru_cache doesn't report which way an individual call went.
+SCHEDULE_CACHE_LOOKUPS = prometheus_client.Counter(
+  'gtfs_schedule_cache_lookups_total',
+  'Lookups of the GetScheduledFor() window cache')
+
+SCHEDULE_CACHE_MISSES = prometheus_client.Counter(
+  'gtfs_schedule_cache_misses_total',
+  'GetScheduledFor() window cache lookups that computed a new result')
+
 # From: https://developers.google.com/transit/gtfs/reference
 ROUTE_TYPES = {
   '0': 'TRAM',
@@ -53,17 +69,161 @@ CALENDAR_DAYS = [
 
 CALENDAR_SERVICE_NOT_AVAILABLE = "0"
 
+# Number of (stop, window) results GetScheduledFor keeps.
+SCHEDULE_CACHE_SIZE = 4096
+
 CALENDAR_EXCEPTION_SERVICE_ADDED = "1"
 CALENDAR_EXCEPTION_SERVICE_REMOVED = "2"
 
+# The columns we use from the larger files; the rest aren't kept in memory.
+STOP_TIMES_COLUMNS = ('trip_id', 'stop_id', 'arrival_time', 'stop_sequence')
+TRIPS_COLUMNS = ('trip_id', 'route_id', 'service_id', 'trip_headsign', 'direction_id')
+
+
+class StopSchedule(NamedTuple):
+  """The trips of one service calling at a stop, sorted by arrival time.
+
+  arrival_seconds and trip_ids are parallel columns; this is considerably
+  more compact than holding a dict per stop_times.txt row. Arrival times are
+  seconds since midnight of the service day, and so may exceed 86400 for trips
+  that run past midnight.
+  """
+  arrival_seconds: array.array
+  trip_ids: List[str]
+
+
+def _ParseTime(t: str) -> int:
+  """Converts a GTFS HH:MM:SS time to seconds since midnight.
+
+  GTFS's data format allows for hours >24 to indicate times the next day.
+  E.g; 25:00 = 0100+1; this is useful if a service starts on one day and
+  carries through to the next. These are preserved as values >= 86400.
+  """
+  # Nearly every row is zero-padded HH:MM:SS; slice those directly and only
+  # fall back to splitting for H:MM:SS or other variations.
+  if len(t) == 8 and t[2] == ':' and t[5] == ':':
+    hour, minute, second = int(t[0:2]), int(t[3:5]), int(t[6:8])
+  else:
+    hour, minute, second = [int(x) for x in t.split(':')]
+
+  if minute > 59 or second > 59:
+    raise ValueError(f'invalid time "{t}"')
+  return hour*3600 + minute*60 + second
+
+
+@overload
+def _Intern(s: str) -> str: ...
+@overload
+def _Intern(s: None) -> None: ...
+def _Intern(s: Optional[str]) -> Optional[str]:
+  """Interns s, tolerating a missing (None) value.
+
+  The loader interns repeated values within each chunk, but a chunk is parsed in
+  its own process; values that repeat across chunks (and trips) are only shared
+  once interned again here.
+  """
+  return sys.intern(s) if s is not None else None
+
+
+def _ParseDate(d: str) -> datetime.date:
+  """Converts a GTFS YYYYMMDD date to a datetime.date.
+
+  The format is fixed, so slicing is much cheaper than strptime.
+  """
+  if len(d) != 8:
+    raise ValueError(f'invalid date "{d}"')
+  return datetime.date(int(d[0:4]), int(d[4:6]), int(d[6:8]))
+
+
+class ServiceCalendar(NamedTuple):
+  """A calendar.txt row, preparsed for lookup.
+
+  weekdays is a bitmask of the days the service runs; bit N corresponds to
+  CALENDAR_DAYS[N], i.e; datetime.date.weekday(). The service's date range is
+  inclusive and held as datetime.date.toordinal() values so the check is a
+  pair of integer comparisons.
+  """
+  weekdays: int
+  start_ordinal: int
+  end_ordinal: int
+
+
+class ServiceDays(NamedTuple):
+  """The days a service runs, with calendar exceptions already applied.
+
+  days[i] is 1 if the service runs on the day with ordinal first_ordinal+i
+  (see datetime.date.toordinal()), and 0 if not.
+  """
+  first_ordinal: int
+  days: bytearray
+
+
+class StopTimes:
+  """A trip's stop_times.txt rows, held as parallel columns.
+
+  Rows are in file order. A trip has tens of stops, and the feed may have
+  hundreds of thousands of trips; columns avoid a dict per row. arrival_seconds
+  is seconds since midnight of the service day (see _ParseTime), or -1 if the
+  row has no usable arrival time.
+  """
+  __slots__ = ('stop_ids', 'arrival_seconds', 'stop_sequences')
+
+  def __init__(self, stop_ids: List[str], arrival_seconds: array.array,
+               stop_sequences: array.array):
+    self.stop_ids = stop_ids
+    self.arrival_seconds = arrival_seconds
+    self.stop_sequences = stop_sequences
+
+  def __len__(self) -> int:
+    return len(self.stop_ids)
+
+  @classmethod
+  def FromRows(cls, rows: List[Dict[str, str]]) -> 'StopTimes':
+    # Blank (or missing, on a short row) arrival times are allowed between
+    # timepoints and are stored as -1, as are unparseable ones.
+    arrivals = []
+    invalid = 0
+    for row in rows:
+      t = row['arrival_time']
+      if not t:
+        arrivals.append(-1)
+        continue
+      try:
+        arrivals.append(_ParseTime(t))
+      except (ValueError, TypeError):
+        invalid += 1
+        arrivals.append(-1)
+
+    if invalid:
+      logging.warning('trip "%s": %d stop times with an invalid arrival_time',
+        rows[0].get('trip_id'), invalid)
+
+    return cls(
+      [_Intern(row['stop_id']) for row in rows],
+      array.array('i', arrivals),
+      array.array('i', [int(row['stop_sequence']) for row in rows]))
+
+
+class Trip:
+  """A trip from trips.txt, with its route and stop times.
+
+  There is one of these per trip in the feed, so it uses __slots__ to keep
+  the per-instance footprint small. route refers to the shared routes.txt row
+  rather than a copy.
+  """
+  __slots__ = ('trip_id', 'trip_headsign', 'direction_id', 'service_id', 'route', 'stop_times')
+
+  def __init__(self, trip_id: str, trip_headsign: Optional[str], direction_id: Optional[str],
+               service_id: str, route: Optional[Dict[str, str]], stop_times: StopTimes):
+    self.trip_id = trip_id
+    self.trip_headsign = trip_headsign
+    self.direction_id = direction_id
+    self.service_id = service_id
+    self.route = route
+    self.stop_times = stop_times
 
-class Trip(NamedTuple):
-  trip_id: str
-  trip_headsign: str
-  direction_id: str
-  service_id: str
-  route: Dict[str, str]
-  stop_times: List[Dict[str, str]]
+  def __repr__(self) -> str:
+    return f'Trip(trip_id={self.trip_id!r}, service_id={self.service_id!r})'
 
 
 class Database:
@@ -73,7 +233,7 @@ class Database:
   application.
   """
 
-  def __init__(self, data_dir: str, keep_stops: List[str]):
+  def __init__(self, data_dir: str, keep_stops: Sequence[str]):
     """Initialises and loads the database.
 
     Args:
@@ -84,45 +244,70 @@ class Database:
     self._data_dir = data_dir
     self._keep_stops = keep_stops
     self._load_all_stops = len(keep_stops) == 0
-    self._stops_db : Dict[str, List[Dict[str, str]]] = {}
+    self._stops_db : Dict[str, Dict[str, StopSchedule]] = {}
     self._trip_db : Dict[str, Trip] = {}
-    self._calendar_db : Dict[str, Dict[str, str]] = {}
-    self._exceptions_db : Dict[str, Dict[datetime.date, str]] = {}
+    self._calendar_db : Dict[str, ServiceCalendar] = {}
+    self._exceptions_db : Dict[Tuple[str, int], str] = {}
+    self._service_days : Dict[str, ServiceDays] = {}
+    self._scheduled = functools.lru_cache(maxsize=SCHEDULE_CACHE_SIZE)(self._ScheduledBetween)
 
   @DATABASE_LOAD.time()
   def Load(self):
-    self._stops_db = self._LoadStops()
-    self._trip_db = self._LoadTrips()
-    self._calendar_db = self._LoadCalendar()
-    self._exceptions_db = self._LoadExceptions()
+    # Only trips.txt (when filtering by stop) depends on another file; load
+    # everything else alongside stop_times.txt, which dominates the load time.
+    # Each loader.Load() does its parsing in worker processes, so threads are
+    # enough to overlap them.
+    with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+      calendar = executor.submit(self._LoadCalendar)
+      exceptions = executor.submit(self._LoadExceptions)
+      routes = executor.submit(self._LoadRoutes)
+
+      # When all stops are kept there's nothing to gain from shipping every
+      # trip_id to the loader's workers; trips without stop times are dropped
+      # by _LoadTrips instead.
+      trips = None
+      if self._load_all_stops:
+        trips = executor.submit(self._Load, 'trips.txt', None, TRIPS_COLUMNS)
+
+      stop_times = self._LoadStopTimes()
+      if trips:
+        trip_rows = trips.result()
+      else:
+        trip_rows = self._Load('trips.txt', {'trip_id': set(stop_times.keys())},
+                               TRIPS_COLUMNS)
+
+      self._trip_db = self._LoadTrips(stop_times, routes.result(), trip_rows)
+      self._stops_db = self._LoadStops(self._trip_db)
+
+      self._calendar_db = calendar.result()
+      self._exceptions_db = exceptions.result()
+
+    self._service_days = self._ExpandServiceDays()
+
+    # Anything cached refers to the previous data.
+    self._scheduled = functools.lru_cache(maxsize=SCHEDULE_CACHE_SIZE)(self._ScheduledBetween)
 
     TRIPDB.observe(len(self._trip_db.keys()))
 
   def GetTrip(self, trip_id: str):
+    """Returns the Trip for trip_id, or None.
+
+    This is instrumented for external callers; internal lookups go directly to
+    self._trip_db so the request metric stays out of hot loops.
+    """
     ret = self._trip_db.get(trip_id, None)
     TRIPDB_REQUESTS.labels(ret is not None).inc()
     return ret
 
-  def _IsValidServiceDay(self, dt: datetime.date, trip_id: str) -> bool:
-    trip = self.GetTrip(trip_id)
-    day = CALENDAR_DAYS[dt.weekday()]
-
-    trip = self.GetTrip(trip_id)
-    service = self._calendar_db.get(trip.service_id, None)
+  def _IsServiceActive(self, service_id: str, dt: datetime.date) -> bool:
+    """Returns True if service_id runs on dt, accounting for exceptions."""
+    service = self._service_days.get(service_id, None)
     if not service:
-      logging.error('service "%s" not found in database', trip.service_id)
+      logging.error('service "%s" not found in database', service_id)
       return False
 
-    start = service['start_date']
-    end = service['end_date']
-    if dt < start or dt > end:
-      return False
-    
-    exc = self._exceptions_db.get(trip.service_id, {}).get(dt)
-    if service.get(day) == CALENDAR_SERVICE_NOT_AVAILABLE:
-      return exc == CALENDAR_EXCEPTION_SERVICE_ADDED
-
-    return exc != CALENDAR_EXCEPTION_SERVICE_REMOVED
+    i = dt.toordinal() - service.first_ordinal
+    return 0 <= i < len(service.days) and service.days[i] == 1
 
   def GetScheduledFor(self, stop_id: str, start: datetime.datetime, end: datetime.datetime):
     """Returns the trips that are scheduled to stop at stop_id between start and end.
@@ -137,86 +322,129 @@ class Database:
     """
     ret : List[Trip] = []
 
-    stops = self._stops_db.get(stop_id, None)
-    if not stops:
+    schedule = self._stops_db.get(stop_id, None)
+    if not schedule:
       logging.error('stop "%s" not found in database', stop_id)
       return ret
 
     if end < start:
       raise ValueError('start must come before end')
 
+    # Callers poll with a rolling window; widen it to whole minutes so that
+    # consecutive polls share a cache entry, then trim to the exact window.
+    one_minute = datetime.timedelta(minutes=1)
+    window_start = start.replace(second=0, microsecond=0)
+    window_end = end.replace(second=0, microsecond=0)
+    if window_end < end:
+      window_end += one_minute
+
+    lo = (start-window_start).total_seconds()
+    hi = (end-window_start).total_seconds()
+    SCHEDULE_CACHE_LOOKUPS.inc()
+    for arrival, trip in self._scheduled(stop_id, window_start, window_end):
+      if lo <= arrival <= hi:
+        ret.append(trip)
+
+    SCHEDULE_RESPONSE.observe(len(ret))
+
+    return ret
+
+  def _ScheduledBetween(self, stop_id: str, start: datetime.datetime,
+                        end: datetime.datetime) -> Tuple[Tuple[float, Trip], ...]:
+    """Returns (arrival, trip) for each trip scheduled at stop_id between start and end.
+
+    Arrivals are in seconds after start; comparisons stay in plain numbers
+    rather than building a datetime per candidate. This is memoized by Load()
+    as self._scheduled.
+    """
+    SCHEDULE_CACHE_MISSES.inc()
+
+    ret : List[Tuple[float, Trip]] = []
+    services = self._stops_db[stop_id]
+
+    # A trip's arrival time is relative to its service date; trips that began
+    # the day before start may still be running, so we check from then.
     one_day = datetime.timedelta(days=1)
-    start_service_date = start.date()-one_day
+    service_date = start.date()-one_day
     end_service_date = end.date()
 
-    possibility = collections.namedtuple('possibility', ['service_date', 'arrival_time'])
+    span = (end-start).total_seconds()
 
-    for s in stops:
-      trip_id = s['trip_id']
-      arrival_time_str = s['arrival_time']
+    while service_date <= end_service_date:
+      # Seconds from start to midnight of service_date (usually negative).
+      midnight = (datetime.datetime.combine(service_date, datetime.time())-start).total_seconds()
 
-      try:
-        # GTFS's data format allows for hours >24 to indicate times the
-        # next day. E.g; 25:00 = 0100+1; this is useful if a service starts
-        # on one day and carries through to the next.
-        hour, minute, second = [int(x) for x in arrival_time_str.split(':')]
-        delta = datetime.timedelta(days=0)
-
-        if hour >= 24:
-          delta = one_day
-          hour -= 24
-
-        a = datetime.time(hour=hour, minute=minute, second=second)
-
-        possibles : List[possibility] = []
-        service_date = start_service_date
-        while service_date <= end_service_date:
-          arrival_time = datetime.datetime.combine(service_date, a)+delta
-          possibles.append(possibility(service_date, arrival_time))
-
-          service_date += one_day
-      except ValueError:
-        logging.exception('invalid format for arrival_time_str "%s"',
-          arrival_time_str)
-        continue
+      # Check each service once per day, and skip all of its trips if it
+      # isn't running.
+      for service_id, schedule in services.items():
+        if not self._IsServiceActive(service_id, service_date):
+          continue
 
-      for p in possibles:
-        valid_day = self._IsValidServiceDay(p.service_date, trip_id)
-        if valid_day and p.arrival_time >= start and p.arrival_time <= end:
-          ret.append(self.GetTrip(trip_id))
+        lo = bisect.bisect_left(schedule.arrival_seconds, -midnight)
+        hi = bisect.bisect_right(schedule.arrival_seconds, span-midnight)
+        for i in range(lo, hi):
+          ret.append((midnight + schedule.arrival_seconds[i],
+                      self._trip_db[schedule.trip_ids[i]]))
 
-    SCHEDULE_RESPONSE.observe(len(ret))
+      service_date += one_day
 
-    return ret
+    # Merge the services back into arrival order.
+    ret.sort(key=lambda x: x[0])
+    return tuple(ret)
 
-  def _LoadStops(self) -> Dict[str, Dict[str, str]]:
-    # First we need to extract the interesting trips and sequences.
+  def _LoadStopTimes(self) -> Dict[str, List[Dict[str, str]]]:
+    """Loads the full stop sequence of every trip calling at a kept stop.
+
+    stop_times.txt is by far the largest file in a GTFS package. When all
+    stops are kept, every trip is interesting and a single pass suffices.
+    Otherwise the first pass only discovers the interesting trip_ids; the
+    second loads their full stop sequences.
+    """
     if self._load_all_stops:
-      tmp_stop_times = self._Load('stop_times.txt')
+      rows = self._Load('stop_times.txt', None, STOP_TIMES_COLUMNS)
     else:
-      tmp_stop_times = self._Load('stop_times.txt',
-        {'stop_id': set(self._keep_stops)})
-
-    return self._Collect(tmp_stop_times, 'stop_id', multi=True)
+      trip_ids = set(row['trip_id'] for row in self._Load('stop_times.txt',
+        {'stop_id': set(self._keep_stops)}, ('trip_id',)))
+      rows = self._Load('stop_times.txt', {'trip_id': trip_ids}, STOP_TIMES_COLUMNS)
+
+    return self._Collect(rows, 'trip_id', multi=True)
+
+  def _LoadStops(self, trip_db: Dict[str, Trip]) -> Dict[str, Dict[str, StopSchedule]]:
+    """Indexes the trips calling at each kept stop by service, sorted by arrival time."""
+    keep = set(self._keep_stops)
+
+    arrivals : Dict[str, Dict[str, List[Tuple[int, str]]]] = {}
+    for trip_id, trip in trip_db.items():
+      st = trip.stop_times
+      for stop_id, secs in zip(st.stop_ids, st.arrival_seconds):
+        if secs < 0:
+          continue
+        if not self._load_all_stops and stop_id not in keep:
+          continue
+
+        services = arrivals.setdefault(stop_id, {})
+        services.setdefault(trip.service_id, []).append((secs, trip_id))
+
+    ret : Dict[str, Dict[str, StopSchedule]] = {}
+    for stop_id, services in arrivals.items():
+      ret[stop_id] = {}
+      for service_id, lst in services.items():
+        lst.sort()
+        ret[stop_id][service_id] = StopSchedule(
+          array.array('i', [a for a, _ in lst]),
+          [t for _, t in lst])
 
-  def _LoadTrips(self) -> Dict[str, Trip]:
-    trip_ids = set()
-    for vals in self._stops_db.values():
-      for stop in vals:
-        trip_ids.add(stop['trip_id'])
-
-    # Now collect the Trip->List of stops
-    stop_times = self._Collect(
-      self._Load('stop_times.txt', {'trip_id': trip_ids}),
-      'trip_id',
-      multi=True)
+    return ret
 
-    # Lets load the routes.
-    routes = self._Collect(self._Load('routes.txt'), 'route_id')
+  def _LoadRoutes(self) -> Dict[str, Dict[str, str]]:
+    """Loads routes.txt."""
+    return self._Collect(self._Load('routes.txt'), 'route_id')
 
-    # Now let's produce the trip database.
-    trips = self._Collect(self._Load('trips.txt', {'trip_id': trip_ids}),
-      'trip_id')
+  def _LoadTrips(self, stop_times: Dict[str, List[Dict[str, str]]],
+                 routes: Dict[str, Dict[str, str]],
+                 trip_rows: List[Dict[str, str]]) -> Dict[str, Trip]:
+    """Builds the trip database from trips.txt rows."""
+    trips = self._Collect(trip_rows, 'trip_id')
 
     trip_db = {}
     for trip_id, row in trips.items():
@@ -227,63 +455,108 @@ class Database:
       st = stop_times.get(trip_id, None)
       if not st:
         logging.debug('Trip "%s" has no stop times', trip_id)
+        continue
 
-      t = Trip(trip_id, row['trip_headsign'], row['direction_id'], row['service_id'],
-               routes.get(route_id, None), st)
+      t = Trip(trip_id, _Intern(row['trip_headsign']), _Intern(row['direction_id']),
+               _Intern(row['service_id']), routes.get(route_id, None), StopTimes.FromRows(st))
       trip_db[trip_id] = t
 
     return trip_db
 
-  def _LoadCalendar(self) -> Dict[str, Dict[str, str]]:
+  def _LoadCalendar(self) -> Dict[str, ServiceCalendar]:
     """Loads calendar.txt."""
     dates = self._Collect(self._Load('calendar.txt'), 'service_id')
+    ret = {}
 
-    for _, data in dates.items():
-      start = datetime.datetime.strptime(data['start_date'], '%Y%m%d').date()
-      end = datetime.datetime.strptime(data['end_date'], '%Y%m%d').date()
-      data['start_date'] = start
-      data['end_date'] = end
-    
-    return dates
+    for service_id, data in dates.items():
+      weekdays = 0
+      for i, day in enumerate(CALENDAR_DAYS):
+        if data.get(day) != CALENDAR_SERVICE_NOT_AVAILABLE:
+          weekdays |= 1 << i
 
-  def _LoadExceptions(self) -> Dict[str, Dict[datetime.date, str]]:
-    """Loads calendar_dates.txt and preparses dates for easy lookup."""
-    dates = self._Collect(self._Load('calendar_dates.txt'), 'service_id', multi=True)
-    ret : Dict[str, Dict] = {service_id: {} for service_id in dates}
+      ret[service_id] = ServiceCalendar(
+        weekdays,
+        _ParseDate(data['start_date']).toordinal(),
+        _ParseDate(data['end_date']).toordinal())
 
-    for service_id, data in dates.items():
-      for d in data:
-        dt = datetime.datetime.strptime(d['date'], '%Y%m%d').date()
-        ret[service_id][dt] = d['exception_type']
+    return ret
+
+  def _LoadExceptions(self) -> Dict[Tuple[str, int], str]:
+    """Loads calendar_dates.txt, keyed by (service_id, date ordinal) for easy lookup."""
+    ret : Dict[Tuple[str, int], str] = {}
+
+    # The same handful of dates (e.g; bank holidays) recur across services.
+    parsed : Dict[str, int] = {}
+
+    for d in self._Load('calendar_dates.txt'):
+      ordinal = parsed.get(d['date'])
+      if ordinal is None:
+        ordinal = parsed[d['date']] = _ParseDate(d['date']).toordinal()
+      ret[(d['service_id'], ordinal)] = d['exception_type']
+
+    return ret
+
+  def _ExpandServiceDays(self) -> Dict[str, ServiceDays]:
+    """Combines calendar.txt and calendar_dates.txt into a per-service ServiceDays."""
+    # Exceptions may add days outside of a service's calendar range, or define
+    # a service that isn't in calendar.txt at all.
+    bounds = {sid: [s.start_ordinal, s.end_ordinal] for sid, s in self._calendar_db.items()}
+    for service_id, ordinal in self._exceptions_db:
+      b = bounds.setdefault(service_id, [ordinal, ordinal])
+      b[0] = min(b[0], ordinal)
+      b[1] = max(b[1], ordinal)
+
+    ret = {}
+    for service_id, (first, last) in bounds.items():
+      days = bytearray(max(0, last-first+1))
+
+      service = self._calendar_db.get(service_id, None)
+      if service:
+        # Repeat the service's week across its date range. Ordinal 1 (0001-01-01)
+        # is a Monday, so an ordinal's weekday is (ordinal-1) % 7.
+        week = bytes((service.weekdays >> ((first+i-1) % 7)) & 1 for i in range(7))
+        lo = service.start_ordinal - first
+        hi = service.end_ordinal - first + 1
+        if hi > lo:
+          days[lo:hi] = (week * ((hi+6)//7))[lo:hi]
+
+      ret[service_id] = ServiceDays(first, days)
+
+    for (service_id, ordinal), exception_type in self._exceptions_db.items():
+      service_days = ret[service_id]
+      if exception_type == CALENDAR_EXCEPTION_SERVICE_ADDED:
+        service_days.days[ordinal - service_days.first_ordinal] = 1
+      elif exception_type == CALENDAR_EXCEPTION_SERVICE_REMOVED:
+        service_days.days[ordinal - service_days.first_ordinal] = 0
 
     return ret
 
-  def _Load(self, filename: str, keep: Dict[str, AbstractSet[str]]=None):
+  def _Load(self, filename: str, keep: Optional[Dict[str, AbstractSet[str]]]=None,
+            columns: Optional[Sequence[str]]=None):
     return gtfs_data.loader.Load(
       os.path.join(os.path.join(self._data_dir, filename)),
-      keep)
+      keep, columns)
 
   def _Collect(self, data: List[Dict[str, str]], key_name: str, multi: bool=False):
-    ret : Dict[str, Any] = {}
-
-    duplicates = 0
-
-    for row in data:
-      if key_name not in row:
-        logging.error('Key "%s" not found in row %s', key_name, row)
-        return None
-
-      key = row[key_name]
+    key = operator.itemgetter(key_name)
 
+    # Rows from a single file share a schema; a missing key is exceptional,
+    # so don't pay for a membership check on every row.
+    try:
       if multi:
-        lst = ret.get(key, [])
-        lst.append(row)
-        ret[key] = lst
-      else:
-        if key in ret:
-          duplicates += 1
-        ret[key] = row
-
+        ret : Dict[str, Any] = collections.defaultdict(list)
+        for row in data:
+          ret[key(row)].append(row)
+        return dict(ret)
+
+      # Later rows win, as if each were assigned in turn.
+      ret = {key(row): row for row in data}
+    except KeyError:
+      row = next(row for row in data if key_name not in row)
+      logging.error('Key "%s" not found in row %s', key_name, row)
+      return None
+
+    duplicates = len(data) - len(ret)
     if duplicates:
       logging.info('Detected %d duplicate %s keys', duplicates, key_name)
 
@@ -1,7 +1,12 @@
 import gtfs_data.database
+import gtfs_data.loader
 
 import datetime
+import sys
 import unittest
+import unittest.mock
+
+from prometheus_client import REGISTRY    # type: ignore[import]
 
 TEST_FILE = 'gtfs_data/testdata/agency.txt'
 GTFS_DATA = 'gtfs_data/testdata'
@@ -33,6 +38,9 @@ class TestDatabase(unittest.TestCase):
       'one': [{'a': 'one', 'b': 200}, {'a': 'one', 'b': 300}],
       'two': [{'a': 'two', 'b': 400}]})
 
+    self.assertIsNone(self.database._Collect(data, 'c'))
+    self.assertIsNone(self.database._Collect(data, 'c', multi=True))
+
   def testGetTrip(self):
     self.database.Load()
     found = self.database.GetTrip('1167')
@@ -73,6 +81,56 @@ class TestDatabase(unittest.TestCase):
       self.assertIsNotNone(t.stop_times)
       self.assertEqual(len(t.stop_times), data['num_stop_times'])
 
+  def testStopTimes(self):
+    self.database.Load()
+
+    st = self.database.GetTrip('1167').stop_times
+    self.assertEqual(st.stop_ids[0], '8250DB003222')
+    self.assertEqual(st.arrival_seconds[0], 7*3600)
+    self.assertEqual(st.stop_sequences[0], 1)
+
+    i = st.stop_ids.index(INTERESTING_STOPS[0])
+    self.assertEqual(st.arrival_seconds[i], 7*3600 + 38*60 + 32)
+    self.assertEqual(st.stop_sequences[i], 56)
+
+  def testStopTimesFromRowsBlankArrival(self):
+    rows = [
+      {'trip_id': 't', 'stop_id': 'a', 'arrival_time': '07:00:00', 'stop_sequence': '1'},
+      {'trip_id': 't', 'stop_id': 'b', 'arrival_time': '', 'stop_sequence': '2'},
+      {'trip_id': 't', 'stop_id': 'c', 'arrival_time': None, 'stop_sequence': '3'},
+    ]
+    with unittest.mock.patch('logging.warning') as warning:
+      st = gtfs_data.database.StopTimes.FromRows(rows)
+      self.assertEqual(list(st.arrival_seconds), [7*3600, -1, -1])
+      warning.assert_not_called()
+
+      rows.append({'trip_id': 't', 'stop_id': 'd', 'arrival_time': '7h', 'stop_sequence': '4'})
+      st = gtfs_data.database.StopTimes.FromRows(rows)
+      warning.assert_called_once()
+    self.assertEqual(list(st.arrival_seconds), [7*3600, -1, -1, -1])
+
+  def testTripFieldsInterned(self):
+    # Load every row in its own chunk, so equal values only share an object
+    # if the database interned them.
+    saved = (gtfs_data.loader.MaxRowsPerChunk, gtfs_data.loader.SmallFileBytes)
+    try:
+      gtfs_data.loader.MaxRowsPerChunk = 1
+      gtfs_data.loader.SmallFileBytes = 0
+      self.database.Load()
+    finally:
+      gtfs_data.loader.MaxRowsPerChunk, gtfs_data.loader.SmallFileBytes = saved
+
+    t1 = self.database.GetTrip('1167')
+    t2 = self.database.GetTrip('1169')
+    self.assertIs(t1.service_id, t2.service_id)
+    self.assertIs(t1.direction_id, t2.direction_id)
+
+    stop_id = '8250DB003076'    # seq 30 for 1167, 25 for 1169
+    s1 = t1.stop_times.stop_ids[t1.stop_times.stop_ids.index(stop_id)]
+    s2 = t2.stop_times.stop_ids[t2.stop_times.stop_ids.index(stop_id)]
+    self.assertIs(s1, s2)
+    self.assertIs(s1, sys.intern(stop_id))
+
   def testLoadAll(self):
     database = gtfs_data.database.Database(GTFS_DATA, [])
     database.Load()
@@ -103,6 +161,40 @@ class TestDatabase(unittest.TestCase):
     self.assertEqual(len(resp), 1)
     self.assertEqual(resp[0].trip_id, '1168')
 
+  def testGetScheduledForCachedWindow(self):
+    self.database.Load()
+    stop_id = INTERESTING_STOPS[0]
+
+    # 1167 arrives at 07:38:32; windows within the same minute share a cache
+    # entry but must still be trimmed to the exact start and end.
+    start = datetime.datetime(2020, 11, 19, 7, 38, 00)
+    stop = datetime.datetime(2020, 11, 19, 8, 22, 00)
+    resp = self.database.GetScheduledFor(stop_id, start, stop)
+    self.assertEqual([t.trip_id for t in resp], ['1167'])
+
+    start = datetime.datetime(2020, 11, 19, 7, 38, 40)
+    stop = datetime.datetime(2020, 11, 19, 8, 22, 13)
+    resp = self.database.GetScheduledFor(stop_id, start, stop)
+    self.assertEqual([t.trip_id for t in resp], ['1169'])
+
+    info = self.database._scheduled.cache_info()
+    self.assertEqual(info.misses, 2)
+
+    lookups = REGISTRY.get_sample_value('gtfs_schedule_cache_lookups_total')
+    misses = REGISTRY.get_sample_value('gtfs_schedule_cache_misses_total')
+
+    start = datetime.datetime(2020, 11, 19, 7, 38, 10)
+    stop = datetime.datetime(2020, 11, 19, 8, 22, 5)
+    resp = self.database.GetScheduledFor(stop_id, start, stop)
+    self.assertEqual([t.trip_id for t in resp], ['1167'])
+    self.assertEqual(self.database._scheduled.cache_info().hits, info.hits + 1)
+    self.assertEqual(REGISTRY.get_sample_value('gtfs_schedule_cache_lookups_total'), lookups + 1)
+    self.assertEqual(REGISTRY.get_sample_value('gtfs_schedule_cache_misses_total'), misses)
+
+    # Reloading must not serve results from the previous data.
+    self.database.Load()
+    self.assertEqual(self.database._scheduled.cache_info().currsize, 0)
+
   def testGetScheduledForOvernightRoutes(self):
     """Test schedule generation for routes that span days"""
     database = gtfs_data.database.Database(GTFS_DATA, [])
@@ -160,46 +252,130 @@ class TestDatabase(unittest.TestCase):
     resp = self.database.GetScheduledFor(stop_id, start, stop)
     self.assertEqual(len(resp), 2)
 
-  def testIsValidServiceDay(self):
+  def testTripServiceDays(self):
     database = gtfs_data.database.Database(GTFS_DATA, [])
     database.Load()
 
+    def isActive(dt, trip_id):
+      return database._IsServiceActive(database.GetTrip(trip_id).service_id, dt)
+
     # The exceptions only apply to trips 1167 and 1169. Trip 1168 has no exceptions
     # but we should check to make sure it still behaves normally.
     removed_service_date = datetime.date(2020, 11, 26)
-    self.assertFalse(database._IsValidServiceDay(removed_service_date, '1167'))
-    self.assertFalse(database._IsValidServiceDay(removed_service_date, '1169'))
-    self.assertTrue(database._IsValidServiceDay(removed_service_date, '1168'))
+    self.assertFalse(isActive(removed_service_date, '1167'))
+    self.assertFalse(isActive(removed_service_date, '1169'))
+    self.assertTrue(isActive(removed_service_date, '1168'))
 
     added_service_date = datetime.date(2020, 11, 27)
-    self.assertTrue(database._IsValidServiceDay(added_service_date, '1167'))
-    self.assertTrue(database._IsValidServiceDay(added_service_date, '1169'))
-    self.assertTrue(database._IsValidServiceDay(added_service_date, '1168'))
+    self.assertTrue(isActive(added_service_date, '1167'))
+    self.assertTrue(isActive(added_service_date, '1169'))
+    self.assertTrue(isActive(added_service_date, '1168'))
 
     normal_service_date  = datetime.date(2020, 11, 19)
-    self.assertTrue(database._IsValidServiceDay(normal_service_date, '1167'))
-    self.assertTrue(database._IsValidServiceDay(normal_service_date, '1169'))
-    self.assertTrue(database._IsValidServiceDay(normal_service_date, '1168'))
+    self.assertTrue(isActive(normal_service_date, '1167'))
+    self.assertTrue(isActive(normal_service_date, '1169'))
+    self.assertTrue(isActive(normal_service_date, '1168'))
 
     normal_no_service_date = datetime.date(2020, 11, 28)
-    self.assertFalse(database._IsValidServiceDay(normal_no_service_date, '1167'))
-    self.assertFalse(database._IsValidServiceDay(normal_no_service_date, '1169'))
-    self.assertFalse(database._IsValidServiceDay(normal_no_service_date, '1168'))
+    self.assertFalse(isActive(normal_no_service_date, '1167'))
+    self.assertFalse(isActive(normal_no_service_date, '1169'))
+    self.assertFalse(isActive(normal_no_service_date, '1168'))
 
     # 1167 and 1169 are Thursday only, 1168 is M-F -- so lets use 1168
     # Valid dates for the schedule are 2020-11-04 to 2021-02-25
     before_start_date = datetime.date(2020, 11, 3)
-    self.assertFalse(database._IsValidServiceDay(before_start_date, '1168'))
+    self.assertFalse(isActive(before_start_date, '1168'))
 
     start_date = datetime.date(2020, 11, 4)
-    self.assertTrue(database._IsValidServiceDay(start_date, '1168'))
+    self.assertTrue(isActive(start_date, '1168'))
 
     end_date = datetime.date(2021, 2, 25)
-    self.assertTrue(database._IsValidServiceDay(end_date, '1168'))
+    self.assertTrue(isActive(end_date, '1168'))
 
     after_end_date = datetime.date(2020, 2, 26)
-    self.assertFalse(database._IsValidServiceDay(after_end_date, '1168'))
+    self.assertFalse(isActive(after_end_date, '1168'))
+
+  def testIsServiceActive(self):
+    database = gtfs_data.database.Database(GTFS_DATA, [])
+    database.Load()
+
+    self.assertFalse(database._IsServiceActive('y1002', datetime.date(2020, 11, 26)))
+    self.assertTrue(database._IsServiceActive('y1002', datetime.date(2020, 11, 27)))
+    self.assertTrue(database._IsServiceActive('2#1', datetime.date(2020, 11, 26)))
+    self.assertFalse(database._IsServiceActive('unknown', datetime.date(2020, 11, 26)))
+
+  def testExpandServiceDays(self):
+    database = gtfs_data.database.Database(GTFS_DATA, [])
+    database.Load()
+
+    service = database._service_days['2#1']
+    self.assertEqual(service.first_ordinal, datetime.date(2020, 11, 4).toordinal())
+    self.assertEqual(len(service.days), 114)
+    for i, running in enumerate(service.days):
+      day = datetime.date.fromordinal(service.first_ordinal + i)
+      self.assertEqual(running, 1 if day.weekday() < 5 else 0, day)
+
+    service = database._service_days['y1002']
+    thursdays = [datetime.date.fromordinal(service.first_ordinal + i)
+                 for i, running in enumerate(service.days) if running]
+    self.assertIn(datetime.date(2020, 11, 27), thursdays)
+    self.assertNotIn(datetime.date(2020, 11, 26), thursdays)
+    # 17 Thursdays, less 2020-11-26, plus 2020-11-27 and 2021-03-05.
+    self.assertEqual(len(thursdays), 18)
+
+    # Added after calendar.txt's end_date (2021-02-28), which extends the range.
+    self.assertEqual(service.first_ordinal + len(service.days) - 1,
+                     datetime.date(2021, 3, 5).toordinal())
+    self.assertTrue(database._IsServiceActive('y1002', datetime.date(2021, 3, 5)))
+    self.assertFalse(database._IsServiceActive('y1002', datetime.date(2021, 3, 4)))
+
+    # Only in calendar_dates.txt: runs on its added day and no other.
+    service = database._service_days['x9999']
+    self.assertEqual(service.first_ordinal, datetime.date(2020, 12, 1).toordinal())
+    self.assertEqual(list(service.days), [1])
+    self.assertTrue(database._IsServiceActive('x9999', datetime.date(2020, 12, 1)))
+    self.assertFalse(database._IsServiceActive('x9999', datetime.date(2020, 12, 2)))
+
+  def testParseTime(self):
+    self.assertEqual(gtfs_data.database._ParseTime('00:00:00'), 0)
+    self.assertEqual(gtfs_data.database._ParseTime('7:20:16'), 26416)
+    self.assertEqual(gtfs_data.database._ParseTime('25:01:00'), 90060)
+    self.assertEqual(gtfs_data.database._ParseTime('125:01:00'), 450060)
+    self.assertRaises(ValueError, gtfs_data.database._ParseTime, '07:60:00')
+    self.assertRaises(ValueError, gtfs_data.database._ParseTime, '07:00')
+    self.assertRaises(ValueError, gtfs_data.database._ParseTime, '07:0a:00')
+
+  def testParseDate(self):
+    self.assertEqual(gtfs_data.database._ParseDate('20201126'), datetime.date(2020, 11, 26))
+    self.assertRaises(ValueError, gtfs_data.database._ParseDate, '2020112')
+    self.assertRaises(ValueError, gtfs_data.database._ParseDate, '20201340')
+
+  def testStopsSortedByArrival(self):
+    database = gtfs_data.database.Database(GTFS_DATA, [])
+    database.Load()
+
+    for stop_id, services in database._stops_db.items():
+      for service_id, schedule in services.items():
+        self.assertEqual(list(schedule.arrival_seconds), sorted(schedule.arrival_seconds))
+        self.assertEqual(len(schedule.arrival_seconds), len(schedule.trip_ids))
+        for trip_id in schedule.trip_ids:
+          self.assertEqual(database.GetTrip(trip_id).service_id, service_id)
+
+    schedule = database._stops_db['ONIGHT-STOP2']['2#1']
+    self.assertEqual(schedule.trip_ids, ['ONIGHT'])
+    self.assertGreaterEqual(schedule.arrival_seconds[0], 86400)
+
+  def testLoadCalendar(self):
+    self.database.Load()
+
+    # Thursday only.
+    service = self.database._calendar_db['y1002']
+    self.assertEqual(service.weekdays, 1 << 3)
+    self.assertEqual(service.start_ordinal, datetime.date(2020, 11, 4).toordinal())
+    self.assertEqual(service.end_ordinal, datetime.date(2021, 2, 28).toordinal())
 
+    # Monday to Friday.
+    self.assertEqual(self.database._calendar_db['2#1'].weekdays, 0b0011111)
 
   def testNumberOfDays(self):
     self.assertEqual(len(gtfs_data.database.CALENDAR_DAYS), 7)
@@ -1,22 +1,33 @@
+import atexit
 import collections
 import concurrent.futures
 import csv
 import logging
 import io
+import mmap
 import os
 import queue
+import sys
 import threading
 
-from typing import AbstractSet, Dict, List, MutableSet, Tuple
+from typing import AbstractSet, Callable, Dict, Iterator, List, MutableSet, Optional, Sequence, Tuple, cast
 
 # Some NTA data files have a single unprintable character upfront; this will cause
-# DictReader to include that character in the key for the first field.
+# the CSV reader to include that character in the name of the first field.
 BROKEN_CHARACTER = '\ufeff'
 
+# Columns whose values repeat heavily across rows (e.g; a trip_id appears once per
+# stop on the trip). These are interned so each distinct value is held once.
+INTERN_COLUMNS = frozenset(['trip_id', 'service_id', 'route_id', 'stop_id', 'direction_id'])
+
 # Module-level tunables
 MaxThreads = 4
 MaxRowsPerChunk = 100000
 
+# Files smaller than this are parsed inline; handing them to worker processes
+# costs more than it saves.
+SmallFileBytes = 2 * 1024 * 1024
+
 class BufferedExecutor:
   """Creates and wraps a ProcessPoolExecutor to limit the number of futures in flight.
 
@@ -26,7 +37,7 @@ class BufferedExecutor:
 
   The use in this module is intended to provide some back-pressure on reading the
   input file; if we create futures much faster than we can process them, we will
-  potentially overwhelm memory on a small system with lots of StringIOs.
+  potentially overwhelm memory on a small system with lots of pending results.
   """
   def __init__(self, max_workers:int=0):
     self._pool = concurrent.futures.ProcessPoolExecutor(max_workers=max_workers)
@@ -38,94 +49,205 @@ class BufferedExecutor:
     f.add_done_callback(lambda unused: self._sem.release())
     return f
 
+  def shutdown(self):
+    self._pool.shutdown()
+
+
+# Shared by all Load() calls, so the worker processes are started once rather
+# than per file.
+_executor : Optional[BufferedExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def _sharedExecutor() -> BufferedExecutor:
+  global _executor
+  with _executor_lock:
+    if _executor is None:
+      _executor = BufferedExecutor(max_workers=MaxThreads)
+    return _executor
+
+
+def Shutdown() -> None:
+  """Stops the loader's worker processes; a later Load() starts new ones."""
+  global _executor
+  with _executor_lock:
+    if _executor is not None:
+      _executor.shutdown()
+      _executor = None
+
 
-def loadChunk(io: io.StringIO, keep: Dict[str, AbstractSet[str]]=None) -> Tuple[List[Dict[str,str]], int]:
+# Stop the workers before the interpreter starts tearing down modules.
+atexit.register(Shutdown)
+
+
+def _MakeMatcher(accept: List[Tuple[int, AbstractSet[str]]]) -> Callable[[List[Optional[str]]], bool]:
+  """Returns a predicate for rows with an acceptable value in each column of accept.
+
+  The database only ever filters on zero or one columns, so those get
+  their own predicates without the general case's loop.
+  """
+  if not accept:
+    return lambda row: True
+
+  if len(accept) == 1:
+    [(i, acceptable_values)] = accept
+    return lambda row: row[i] in acceptable_values
+
+  return lambda row: all(row[i] in acceptable_values for i, acceptable_values in accept)
+
+
+def loadChunk(io: io.StringIO, keep: Optional[Dict[str, AbstractSet[str]]]=None,
+              columns: Optional[Sequence[str]]=None) -> Tuple[List[Dict[str, Optional[str]]], int]:
   """Worker code for LoadParallel.
 
   Args:
     io: a StringIO to read from
     keep: same as in LoadParallel
+    columns: same as in LoadParallel
 
   Returns:
-    A tuple containing a list of Dict[str, str] for each row matching keep,
-    and an integer for each discarded row.
+    A tuple containing a list of Dict[str, Optional[str]] for each row matching
+    keep, and an integer for each discarded row.
   """
-  ret = []
+  ret : List[Dict[str, Optional[str]]] = []
   discard = 0
   keep = keep or {}
 
-  reader = csv.DictReader(io)
+  # Resolve column names to indices once, so rows can be filtered as plain
+  # lists; only the rows we keep are turned into dicts.
+  reader = csv.reader(io)
+  fieldnames = [sys.intern(f) for f in next(reader, [])]
+  width = len(fieldnames)
+  accept = [(fieldnames.index(k), acceptable_values) for k, acceptable_values in keep.items()]
+  matches = _MakeMatcher(accept)
+  intern = [i for i, k in enumerate(fieldnames) if k in INTERN_COLUMNS]
+
+  # Columns the file doesn't have are left as None, as for short rows.
+  take = None
+  if columns is not None:
+    take = [(sys.intern(c), fieldnames.index(c) if c in fieldnames else None) for c in columns]
 
-  for row in reader:
-    match = True
-    for k, acceptable_values in keep.items():
-      if row[k] not in acceptable_values:
-        match = False
-        break
+  # Short rows are padded with None below.
+  for row in cast(Iterator[List[Optional[str]]], reader):
+    if not row:
+      continue
 
-    if match:
-      ret.append(row)
+    # Like DictReader, short rows leave trailing columns as None.
+    if len(row) < width:
+      row += [None] * (width - len(row))
+
+    if matches(row):
+      # Pickling the result back to Load preserves sharing within a chunk.
+      for i in intern:
+        value = row[i]
+        if value is not None:
+          row[i] = sys.intern(value)
+      if take is None:
+        ret.append(dict(zip(fieldnames, row)))
+      else:
+        ret.append({c: row[i] if i is not None else None for c, i in take})
     else:
       discard += 1
 
   return ret, discard
 
 
-def Load(filename: str, keep: Dict[str, AbstractSet[str]]=None) -> List[Dict[str,str]]:
+def loadRange(filename: str, start: int, end: int, header: bytes,
+              keep: Optional[Dict[str, AbstractSet[str]]]=None,
+              columns: Optional[Sequence[str]]=None) -> Tuple[List[Dict[str, Optional[str]]], int]:
+  """Worker code for Load; parses the rows between two byte offsets of filename.
+
+  Only the offsets cross the process boundary; the worker reads its own slice
+  of the file rather than having the parent copy and pickle it.
+
+  Args:
+    filename: the file to read
+    start: byte offset of the first row
+    end: byte offset just past the last row
+    header: the file's header line, as bytes
+    keep: same as in Load
+    columns: same as in Load
+
+  Returns:
+    Same as loadChunk.
+  """
+  with open(filename, 'rb') as f:
+    f.seek(start)
+    data = header + f.read(end - start)
+
+  return loadChunk(io.StringIO(data.decode('utf-8'), newline=''), keep, columns)
+
+
+def Load(filename: str, keep: Optional[Dict[str, AbstractSet[str]]]=None,
+         columns: Optional[Sequence[str]]=None) -> List[Dict[str, Optional[str]]]:
   """Loads GTFS package data from a given file.
 
   Args:
     filename: relative or absolute path to a GTFS txt data file
     keep: an allow list keys and allowable values. If there are multiple keys, then each
       row read much have an acceptable value for each key.
+    columns: if set, only these columns are included in each returned row. keep may
+      still filter on columns not listed here.
 
   Returns:
-    A list of Dict[str,str] for each row matching keep.
+    A list of Dict[str, Optional[str]] for each row matching keep. Columns missing
+    from a short row, or not in the file, are None.
 
   Raises:
     FileNotFoundError if filename isn't present.
   """
   keep = keep or {}
-  pool = BufferedExecutor(max_workers=MaxThreads)
   futures = []
 
-  # We will read MaxRowsPerChunk into a StringIO, then pass it to a worker
-  # to parse the CSV.
-  with open(filename) as f:
-    # If a broken character is present, read it out of the buffer. If not
-    # seek back.
-    first = f.read(1)
-    if first != BROKEN_CHARACTER:
-      f.seek(0)
-
-    # Includes fieldnames.
-    header = f.readline()
-    count = 0
-    accum = io.StringIO()
-
-    for line in f:
-      if count % MaxRowsPerChunk == 0:
-        if accum.tell() > 0:
-          accum.seek(0)
-          futures.append(pool.submit(loadChunk, accum, keep))
-
-        accum = io.StringIO()
-        accum.write(header)
-        count = 0
-
-      accum.write(line)
-      count += 1
-
-    # Clear out any remaining lines.
-    if accum.tell() > 0:
-      accum.seek(0)
-      futures.append(pool.submit(loadChunk, accum, keep))
-
-  ret = []
+  # We find the byte offsets of each run of MaxRowsPerChunk lines, then pass
+  # those to a worker to read and parse.
+  with open(filename, 'rb') as f:
+    size = os.fstat(f.fileno()).st_size
+    if size == 0:
+      return []
+
+    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+      # If a broken character is present, skip over it.
+      pos = 0
+      broken = BROKEN_CHARACTER.encode('utf-8')
+      if mm[:len(broken)] == broken:
+        pos = len(broken)
+
+      # Includes fieldnames.
+      newline = mm.find(b'\n', pos)
+      header = mm[pos:newline+1] if newline >= 0 else mm[pos:]
+      pos += len(header)
+
+      if size < SmallFileBytes:
+        rows, discard = loadRange(filename, pos, size, header, keep, columns)
+        logging.debug('Loaded "%s" inline: %d rows loaded, %d discarded (filtering on=%s)',
+          filename, len(rows), discard, keep.keys())
+        return rows
+
+      pool = _sharedExecutor()
+      while pos < size:
+        end = pos
+        for _ in range(MaxRowsPerChunk):
+          end = mm.find(b'\n', end) + 1
+          if end == 0:
+            end = size
+            break
+
+        futures.append(pool.submit(loadRange, filename, pos, end, header, keep, columns))
+        pos = end
+
+  # Merge in file order. The first chunk's list is adopted rather than copied,
+  # and each future is dropped once merged so its chunk can be freed as we go
+  # instead of every chunk staying referenced until the end.
+  ret : List[Dict[str, Optional[str]]] = []
   discard = 0
-  for ft in futures:
-    r, d = ft.result()
-    ret += r
+  futures.reverse()
+  while futures:
+    r, d = futures.pop().result()
+    if ret:
+      ret += r
+    else:
+      ret = r
     discard += d
 
   logging.debug('Loaded "%s": %d rows loaded, %d discarded (filtering on=%s)',
@@ -1,9 +1,12 @@
 import gtfs_data.loader
 
+import io
+import sys
 import unittest
 
 TEST_FILE = 'gtfs_data/testdata/agency.txt'
 TEST_FILE_BROKEN_CHARACTER = 'gtfs_data/testdata/calendar.txt'
+TEST_FILE_STOP_TIMES = 'gtfs_data/testdata/stop_times.txt'
 FIRST_ROW = {
   'agency_id': '03C',
   'agency_name': 'GoAhead Commuter',
@@ -37,5 +40,46 @@ class TestLoader(unittest.TestCase):
     result = gtfs_data.loader.Load(TEST_FILE_BROKEN_CHARACTER)
     self.assertIn('service_id', result[0].keys())
 
+  def testLoadChunkShortRow(self):
+    data = io.StringIO('a,b,c\n1,2,3\n\n4,5\n')
+    result, discard = gtfs_data.loader.loadChunk(data, {'a': set(['1', '4'])})
+    self.assertEqual(discard, 0)
+    self.assertEqual(result, [
+      {'a': '1', 'b': '2', 'c': '3'},
+      {'a': '4', 'b': '5', 'c': None}])
+
+  def testLoadAcrossChunks(self):
+    expected = gtfs_data.loader.Load(TEST_FILE_STOP_TIMES)
+
+    saved = (gtfs_data.loader.MaxRowsPerChunk, gtfs_data.loader.SmallFileBytes)
+    try:
+      gtfs_data.loader.MaxRowsPerChunk = 7
+      gtfs_data.loader.SmallFileBytes = 0
+      result = gtfs_data.loader.Load(TEST_FILE_STOP_TIMES)
+    finally:
+      gtfs_data.loader.MaxRowsPerChunk, gtfs_data.loader.SmallFileBytes = saved
+
+    self.assertEqual(len(result), 166)
+    self.assertEqual(result, expected)
+
+  def testInternedColumns(self):
+    result = gtfs_data.loader.Load(TEST_FILE_STOP_TIMES, {'trip_id': set(['1167'])})
+    self.assertGreater(len(result), 1)
+    self.assertIs(result[0]['trip_id'], result[1]['trip_id'])
+
+  def testLoadColumns(self):
+    result = gtfs_data.loader.Load(TEST_FILE_STOP_TIMES, {'stop_id': set(['8220DB000490'])},
+                                   ['trip_id', 'arrival_time', 'missing'])
+    self.assertGreater(len(result), 0)
+    for row in result:
+      self.assertEqual(list(row.keys()), ['trip_id', 'arrival_time', 'missing'])
+      self.assertIsNone(row['missing'])
+
+  def testLoadChunkInternsFieldnames(self):
+    data = io.StringIO('trip_id,stop_id\n1,a\n2,b\n')
+    result, _ = gtfs_data.loader.loadChunk(data)
+    key = next(iter(result[0]))
+    self.assertIs(key, sys.intern('trip_id'))
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,9 +1,13 @@
+import email.utils
+import functools
+import html
 import logging
 import http.server
 import urllib.parse
 import socketserver
+import time
 
-from typing import Callable, Dict
+from typing import Callable, Dict, Optional, Union
 
 import prometheus_client    # type: ignore[import]
 
@@ -24,64 +28,121 @@ UNKNOWN_PATH_COUNT = prometheus_client.Counter(
   'Requests to unknown paths in the internal webserver')
 
 
+# Static HTML, encoded once. The title is the only part of the head that
+# varies.
+HTML_HEAD_PREFIX = b"""<!doctype html>
+<html itemscope="" itemtype="http://schema.org/WebPage" lang="en-IE">
+<head>
+  <meta charset="UTF-8">
+  <title>"""
+
+HTML_HEAD_SUFFIX = b"""</title>
+</head>
+<body>
+"""
+
+HTML_FOOT = b"</body></html>"
+
+
+@functools.lru_cache(maxsize=1)
+def _HTTPDate(timestamp: int) -> str:
+  """Formats the Date header; every response in the same second shares it."""
+  return email.utils.formatdate(timestamp, usegmt=True)
+
+
+@functools.lru_cache(maxsize=128)
+def _Render404(path: str) -> bytes:
+  """Renders the 404 page for path; repeat requests for a path are common."""
+  return (HTML_HEAD_PREFIX + b'404 Not Found' + HTML_HEAD_SUFFIX +
+          f"<h1>404 Not Found</h1><p>Unknown path: {html.escape(path)}".encode('utf-8') +
+          HTML_FOOT)
+
+
 class RequestHandler(http.server.BaseHTTPRequestHandler):
   # Override StreamRequestHandler.timeout; applies to the
   # request socket.
   timeout = 5
 
+  # Lets pollers reuse their connection. Responses must carry a
+  # Content-Length to be kept alive; see SendHeaders.
+  protocol_version = 'HTTP/1.1'
+
   def do_GET(self):
-    pr = urllib.parse.urlparse(self.path)
-    path = pr.path
-    self.params = urllib.parse.parse_qs(pr.query)
+    # Request targets are origin-form ("/path?query"), so there's no need for a
+    # full urlparse; and unknown paths don't need their query parsed at all.
+    path, _, query = self.path.partition('?')
 
     h = self.server.Lookup(path)
     if h:
+      self.params = urllib.parse.parse_qs(query) if query else {}
       h(self)
-      REQUEST_COUNT.labels(self.path).inc()
+      self.server.RequestCounter(path).inc()
     else:
       self.Handle404()
       UNKNOWN_PATH_COUNT.inc()
 
   def Handle404(self):
-    self.SendHeaders(404, 'text/html')
-
-    html = self.GenerateHTMLHead('404 Not Found')
-    html += f"<h1>404 Not Found</h1><p>Unknown path: {self.path}"
-    html += self.GenerateHTMLFoot()
-
-    self.Send(html)
-
-  def SendHeaders(self, code: int, contentType: str='text/html') -> None:
+    out = _Render404(self.path)
+    self.SendHeaders(404, 'text/html', len(out))
+    self.Send(out)
+
+  def date_time_string(self, timestamp=None):
+    # Overrides BaseHTTPRequestHandler; called by send_response() for the Date
+    # header of every response.
+    if timestamp is None:
+      return _HTTPDate(int(time.time()))
+    return super().date_time_string(timestamp)
+
+  def SendHeaders(self, code: int, contentType: str='text/html',
+                  contentLength: Optional[int]=None) -> None:
     RESPONSE_STATUS.labels(code).inc()
 
     self.send_response(code)
     self.send_header('Content-type', contentType)
+    if contentLength is not None:
+      self.send_header('Content-Length', str(contentLength))
+    else:
+      # Without a length the client can only find the end of the body by
+      # the connection closing.
+      self.send_header('Connection', 'close')
+      self.close_connection = True
     self.end_headers()
 
-  def Send(self, out: str) -> None:
-    self.wfile.write(bytes(out, 'utf-8'))
+  def Send(self, out: Union[str, bytes]) -> None:
+    if isinstance(out, str):
+      out = out.encode('utf-8', 'replace')
+    self.wfile.write(out)
 
-  def GenerateHTMLHead(self, title: str) -> str:
-    return f"""<!doctype html>
-<html itemscope="" itemtype="http://schema.org/WebPage" lang="en-IE">
-<head>
-  <meta charset="UTF-8">
-  <title>{title}</title>
-</head>
-<body>
-"""
+  def GenerateHTMLHead(self, title: str) -> bytes:
+    return HTML_HEAD_PREFIX + title.encode('utf-8', 'replace') + HTML_HEAD_SUFFIX
 
-  def GenerateHTMLFoot(self) -> str:
-    return "</body></html>"
+  def GenerateHTMLFoot(self) -> bytes:
+    return HTML_FOOT
 
 
-class HTTPServer(http.server.HTTPServer):
+class HTTPServer(http.server.ThreadingHTTPServer):
+  """Serves each request in its own thread.
+
+  A slow request (e.g. waiting on the realtime API) no longer holds up
+  others. Handlers must be registered before serving starts; after that the
+  server's state is read-only.
+  """
+  # Don't let in-flight requests hold up shutdown.
+  daemon_threads = True
+
   def __init__(self, port: int=6824):
     super().__init__(('', port), RequestHandler)
     self._handlers : Dict[str, Callable[[RequestHandler], None]] = {}
+    self._request_counters : Dict[str, prometheus_client.Counter] = {}
 
   def Register(self, path: str, handler: Callable[[RequestHandler], None]):
     self._handlers[path] = handler
+    # Only registered paths (never query strings) are used as labels, so the
+    # label set stays bounded and each child can be resolved once.
+    self._request_counters[path] = REQUEST_COUNT.labels(path)
+
+  def RequestCounter(self, path: str) -> prometheus_client.Counter:
+    return self._request_counters[path]
 
   def Lookup(self, path: str):
     return self._handlers.get(path, None)
@@ -0,0 +1,40 @@
+import httpd
+
+import http.client
+import threading
+import unittest
+import unittest.mock
+
+
+class TestHTTPServer(unittest.TestCase):
+  def setUp(self):
+    patcher = unittest.mock.patch.object(httpd.RequestHandler, 'log_message')
+    patcher.start()
+    self.addCleanup(patcher.stop)
+
+    self.server = httpd.HTTPServer(0)
+    thread = threading.Thread(target=self.server.serve_forever, args=(0.01,), daemon=True)
+    thread.start()
+    self.addCleanup(self.server.server_close)
+    self.addCleanup(self.server.shutdown)
+
+  def get(self, path: str) -> http.client.HTTPResponse:
+    conn = http.client.HTTPConnection('127.0.0.1', self.server.server_address[1])
+    self.addCleanup(conn.close)
+    conn.request('GET', path)
+    return conn.getresponse()
+
+  def testRegisteredPath(self):
+    self.server.Register('/x', lambda req: req.SendHeaders(200, 'text/plain', 0))
+    self.assertEqual(self.get('/x?a=1').status, 200)
+
+  def test404Escaped(self):
+    resp = self.get('/x?<script>')
+    self.assertEqual(resp.status, 404)
+    body = resp.read()
+    self.assertIn(b'Unknown path: /x?&lt;script&gt;', body)
+    self.assertNotIn(b'<script>', body)
+
+
+if __name__ == '__main__':
+  unittest.main()
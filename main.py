@@ -10,18 +10,20 @@ import transit
 import argparse
 import collections
 import configparser
-import datetime
 import faulthandler
 import functools
+import html
 import json
 import logging
 import os
 import sys
+import threading
 import time
 import urllib.request
 
-from typing import List, NamedTuple
+from typing import Callable, Dict, List, NamedTuple, Sequence, Tuple
 
+from google.protobuf import text_format    # type: ignore[import]
 import prometheus_client    # type: ignore[import]
 
 
@@ -31,10 +33,17 @@ API_ENV = prometheus_client.Info(
   'NTA environment that gtfs-upcoming is bound')
 
 
+# Seconds a JSON response is reused for the same stops.
+RESPONSE_CACHE_TTL = 5.0
+
+# Number of distinct (endpoint, stops) responses kept.
+RESPONSE_CACHE_SIZE = 64
+
+
 class Configuration(NamedTuple):
   api_key_primary: str
   api_key_secondary: str
-  interesting_stops: List[str]
+  interesting_stops: Tuple[str, ...]
 
 
 def _read_config(filename: str) -> Configuration:
@@ -57,10 +66,12 @@ def _read_config(filename: str) -> Configuration:
     pri = keys['PrimaryApiKey']
     sec = keys['SecondaryApiKey']
 
-    stops : List[str] = []
+    stops : Tuple[str, ...] = ()
     stop_ids = config.get('Upcoming', 'InterestingStopIds', fallback=None)
     if stop_ids:
-      stops = stop_ids.split(',')
+      # Tolerate "a, b" and trailing commas; stray whitespace would otherwise
+      # never match a stop_id.
+      stops = tuple(s.strip() for s in stop_ids.split(',') if s.strip())
 
     return Configuration(
       api_key_primary=pri,
@@ -71,54 +82,112 @@ def _read_config(filename: str) -> Configuration:
     raise
 
 
+class HTMLStream:
+  """A text stream that HTML-escapes what's written and sends it in chunks."""
+  def __init__(self, req: httpd.RequestHandler, chunk_size: int=64*1024):
+    self._req = req
+    self._chunk_size = chunk_size
+    self._buf : List[str] = []
+    self._len = 0
+
+  def write(self, s: str) -> None:
+    self._buf.append(s)
+    self._len += len(s)
+    if self._len >= self._chunk_size:
+      self.flush()
+
+  def flush(self) -> None:
+    if self._buf:
+      self._req.Send(html.escape(''.join(self._buf), quote=False).encode('utf-8', 'replace'))
+      self._buf = []
+      self._len = 0
+
+
 class TransitHandler:
-  def __init__(self, transit: transit.Transit, stops: List[str]):
+  def __init__(self, transit: transit.Transit, stops: Sequence[str],
+               cache_ttl: float=RESPONSE_CACHE_TTL):
     self._transit = transit
-    self._stops = stops
+    # Handed to every request that doesn't name its own stops; a tuple can't
+    # be changed underneath them.
+    self._stops = tuple(stops)
+
+    # (name, stops) -> (expiry, body). Pollers tend to ask for the same stops
+    # repeatedly; serving them the same body for a few seconds saves a
+    # realtime API fetch and a serialisation per request.
+    self._cache_ttl = cache_ttl
+    self._cache : Dict[Tuple[str, Tuple[str, ...]], Tuple[float, bytes]] = {}
+    self._cache_lock = threading.Lock()
 
   def HandleUpcoming(self, req: httpd.RequestHandler) -> None:
     stops = req.params.get('stop', self._stops)
-
-    data = self._transit.GetUpcoming(stops)
-    req.SendHeaders(200, 'application/json')
-    req.Send(json.dumps({
-      'current_timestamp': int(datetime.datetime.now().timestamp()),
-      'upcoming': [d.Dict() for d in data]
-    }))
+    self._SendJSON(req, 'upcoming', stops, self._transit.GetUpcoming)
 
   def HandleScheduled(self, req: httpd.RequestHandler) -> None:
     stops = req.params.get('stop', self._stops)
-    data = self._transit.GetScheduled(stops)
-
-    req.SendHeaders(200, 'application/json')
-    req.Send(json.dumps({
-      'current_timestamp': int(datetime.datetime.now().timestamp()),
-      'scheduled': [d.Dict() for d in data]
-    }))
+    self._SendJSON(req, 'scheduled', stops, self._transit.GetScheduled)
 
   def HandleLive(self, req: httpd.RequestHandler) -> None:
     stops = req.params.get('stop', self._stops)
-    data = self._transit.GetLive(stops)
+    self._SendJSON(req, 'live', stops, self._transit.GetLive)
 
-    req.SendHeaders(200, 'application/json')
-    req.Send(json.dumps({
-      'current_timestamp': int(datetime.datetime.now().timestamp()),
-      'live': [d.Dict() for d in data]
-    }))
+  def _SendJSON(self, req: httpd.RequestHandler, name: str, stops: Sequence[str],
+                get_fn: Callable[[Sequence[str]], List[transit.Upcoming]]) -> None:
+    key = (name, tuple(stops))
+    now = time.monotonic()
+
+    with self._cache_lock:
+      cached = self._cache.get(key, None)
+
+    if cached and cached[0] > now:
+      out = cached[1]
+    else:
+      # Compact separators keep the payload small; encoded once and sent as is.
+      # The timestamp is cached with the body so it always matches dueInSeconds.
+      out = json.dumps({
+        'current_timestamp': int(time.time()),
+        name: [d.Dict() for d in get_fn(stops)]
+      }, separators=(',', ':')).encode('utf-8')
+
+      if self._cache_ttl > 0:
+        self._CacheResponse(key, now + self._cache_ttl, out)
+
+    req.SendHeaders(200, 'application/json', len(out))
+    req.Send(out)
+
+  def _CacheResponse(self, key: Tuple[str, Tuple[str, ...]], expiry: float,
+                     out: bytes) -> None:
+    with self._cache_lock:
+      # Re-insert rather than update in place: dicts keep insertion order, so
+      # this keeps the least recently cached entries first.
+      self._cache.pop(key, None)
+      if len(self._cache) >= RESPONSE_CACHE_SIZE:
+        now = time.monotonic()
+        self._cache = {k: v for k, v in self._cache.items() if v[0] > now}
+        # Still full of live entries; drop the least recently cached.
+        if len(self._cache) >= RESPONSE_CACHE_SIZE:
+          del self._cache[next(iter(self._cache))]
+
+      self._cache[key] = (expiry, out)
 
   def HandleDebug(self, req: httpd.RequestHandler) -> None:
-    start = datetime.datetime.now()
+    start = time.perf_counter()
     pb = self._transit.LoadFromAPI()
-    stop = datetime.datetime.now()
+    elapsed = time.perf_counter() - start
 
+    # The feed can run to megabytes of text, so it's streamed rather than built
+    # up in memory. Without a length up front, the connection closes after.
     req.SendHeaders(200, 'text/html')
-    html = req.GenerateHTMLHead('Debug')
-    html += f"<h1>Debug</h1><p>Interesting stops: {self._stops}</p>"
-    html += f"<pre>Received {pb.ByteSize()/1024:.6} kB in {(stop-start).total_seconds():.6} seconds</pre>"
-    html += f"<pre>{pb!s}</pre>"
-    html += req.GenerateHTMLFoot()
+    req.Send(req.GenerateHTMLHead('Debug') + f"""<h1>Debug</h1><p>Interesting stops: {html.escape(str(self._stops), quote=False)}</p>
+<pre>Received {pb.ByteSize()/1024:.6} kB in {elapsed:.6} seconds</pre>
+<pre>""".encode('utf-8', 'replace'))
+
+    # as_utf8 skips escaping every non-ASCII character (e.g. in alert text)
+    # as octal.
+    stream = HTMLStream(req)
+    text_format.PrintMessage(pb, stream, as_utf8=True)
+    stream.flush()
 
-    req.Send(html)
+    req.Send(b'</pre>' + req.GenerateHTMLFoot())
 
 
 def main(argv: List[str]) -> None:
@@ -133,8 +202,15 @@ def main(argv: List[str]) -> None:
   parser.add_argument('--loader_max_threads', help='Max load threads', default=os.cpu_count())
   parser.add_argument('--loader_max_rows_per_chunk', help='Number of rows per threaded chunk', default=100000)
   parser.add_argument('--provider', help='One of nta (Ireland) or vicroads (Victoria Australia)', default='nta')
+  parser.add_argument('--response_cache_ttl', help='Seconds to reuse a JSON response for the same stops; 0 disables', default=RESPONSE_CACHE_TTL)
   args = parser.parse_args()
 
+  # The log format doesn't include thread or process details, so don't collect
+  # them for every record.
+  logging.logThreads = False
+  logging.logProcesses = False
+  logging.logMultiprocessing = False
+
   logging.basicConfig(
       format='%(asctime)s %(levelname)8s %(message)s',
       datefmt='%Y/%m/%d %H:%M:%S',
@@ -178,6 +254,9 @@ def main(argv: List[str]) -> None:
     logging.error(fnfex)
     logging.fatal("Incomplete or missing GTFS database in %s. Run update-database.sh", args.gtfs)
     exit(-2)
+  finally:
+    # Nothing else loads GTFS data; don't keep idle workers around.
+    gtfs_data.loader.Shutdown()
 
   fetcher = fetch.MakeFetcher(args.provider, args.env, config.api_key_primary)
   t = transit.Transit(fetcher.Fetch, database)
@@ -185,7 +264,7 @@ def main(argv: List[str]) -> None:
   port = int(args.port)
   logging.info("Starting HTTP server on port %d", port)
   http = httpd.HTTPServer(port)
-  handler = TransitHandler(t, config.interesting_stops)
+  handler = TransitHandler(t, config.interesting_stops, float(args.response_cache_ttl))
   http.Register('/upcoming.json', handler.HandleUpcoming)
   http.Register('/scheduled.json', handler.HandleScheduled)
   http.Register('/live.json', handler.HandleLive)
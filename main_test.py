@@ -0,0 +1,105 @@
+import main
+
+import json
+import unittest
+import unittest.mock
+
+
+class FakeTransit:
+  def __init__(self):
+    self.calls = 0
+
+  def GetUpcoming(self, stops):
+    self.calls += 1
+    return []
+
+
+class FakeRequest:
+  def __init__(self, stops=None):
+    self.params = {'stop': stops} if stops else {}
+    self.code = None
+    self.body = b''
+    self.sent = []
+
+  def SendHeaders(self, code, contentType='text/html', contentLength=None):
+    self.code = code
+
+  def Send(self, out):
+    self.body += out
+    self.sent.append(out)
+
+
+class TestHTMLStream(unittest.TestCase):
+  def testEscapesAcrossChunks(self):
+    req = FakeRequest()
+    stream = main.HTMLStream(req, chunk_size=4)
+    for s in ['x<', 'b>', '&y']:
+      stream.write(s)
+    stream.flush()
+
+    self.assertEqual(req.sent, [b'x&lt;b&gt;', b'&amp;y'])
+
+  def testFlushEmpty(self):
+    req = FakeRequest()
+    main.HTMLStream(req).flush()
+    self.assertEqual(req.sent, [])
+
+
+class TestTransitHandler(unittest.TestCase):
+  def setUp(self):
+    self.transit = FakeTransit()
+    self.now = 100.0
+    patcher = unittest.mock.patch('main.time.monotonic', lambda: self.now)
+    patcher.start()
+    self.addCleanup(patcher.stop)
+
+  def get(self, handler, *stops):
+    req = FakeRequest(list(stops))
+    handler.HandleUpcoming(req)
+    self.assertEqual(req.code, 200)
+    return json.loads(req.body)
+
+  def testResponseCached(self):
+    handler = main.TransitHandler(self.transit, ['a'], cache_ttl=5)
+    first = self.get(handler)
+    self.now += 4
+    self.assertEqual(self.get(handler), first)
+    self.assertEqual(self.transit.calls, 1)
+
+    # Other stops are cached separately.
+    self.get(handler, 'b')
+    self.assertEqual(self.transit.calls, 2)
+
+  def testResponseCacheExpires(self):
+    handler = main.TransitHandler(self.transit, ['a'], cache_ttl=5)
+    self.get(handler)
+    self.now += 5
+    self.get(handler)
+    self.assertEqual(self.transit.calls, 2)
+
+  def testResponseCacheDisabled(self):
+    handler = main.TransitHandler(self.transit, ['a'], cache_ttl=0)
+    self.get(handler)
+    self.get(handler)
+    self.assertEqual(self.transit.calls, 2)
+    self.assertEqual(handler._cache, {})
+
+  def testResponseCacheEvictsLeastRecentlyCached(self):
+    handler = main.TransitHandler(self.transit, ['a'], cache_ttl=10)
+    with unittest.mock.patch('main.RESPONSE_CACHE_SIZE', 3):
+      self.get(handler, 'a')
+      self.now += 1
+      self.get(handler, 'b')
+
+      # a expires and is cached again; that makes b the oldest entry.
+      self.now += 9.5
+      self.get(handler, 'a')
+      self.get(handler, 'c')
+      self.get(handler, 'd')
+
+    self.assertEqual(set(stops for _, stops in handler._cache),
+                     set([('a',), ('c',), ('d',)]))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -2,7 +2,7 @@ import gtfs_data.database
 
 import datetime
 import logging
-from typing import Any, Callable, Dict, List, NamedTuple
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
 
 from google.transit import gtfs_realtime_pb2    # type: ignore[import]
 import prometheus_client                        # type: ignore[import]
@@ -54,13 +54,25 @@ def now() -> datetime.datetime:
   return datetime.datetime.now()
 
 
-def parseTime(t: str) -> datetime.datetime:
-  """Converts HH:MM:SS to a datetime.datetime"""
-  base_date = now().date()
-  if t.startswith('24:'):
-    t = t.replace('24:', '00:')
-    base_date += datetime.timedelta(days=1)
-  return datetime.datetime.combine(base_date, datetime.datetime.strptime(t, '%H:%M:%S').time())
+def secondsToTime(secs: int) -> datetime.datetime:
+  """Converts seconds since midnight (as held in StopTimes) to a datetime.datetime
+
+  Times past midnight (>= 86400) roll over to the next day.
+  """
+  base = datetime.datetime.combine(now().date(), datetime.time())
+  return base + datetime.timedelta(seconds=secs)
+
+
+def arrivalAt(st: gtfs_data.database.StopTimes, stop_id: str) -> int:
+  """Returns the first scheduled arrival at stop_id, or -1 if it has none.
+
+  A trip may pass a stop more than once, and GTFS allows arrival times to be
+  blank (stored as -1) at stops that aren't timepoints.
+  """
+  for sid, secs in zip(st.stop_ids, st.arrival_seconds):
+    if sid == stop_id and secs >= 0:
+      return secs
+  return -1
 
 
 def delta_seconds(now: datetime.datetime, then: datetime.datetime) -> float:
@@ -70,10 +82,10 @@ def delta_seconds(now: datetime.datetime, then: datetime.datetime) -> float:
 
 class Upcoming(NamedTuple):
   trip_id: str
-  route: str
-  route_type: str
-  headsign: str
-  direction: str
+  route: Optional[str]
+  route_type: Optional[str]
+  headsign: Optional[str]
+  direction: Optional[str]
   stop_id: str
   dueTime: str
   dueInSeconds: float
@@ -86,10 +98,17 @@ class Upcoming(NamedTuple):
 
   @classmethod
   def FromTrip(cls, trip: gtfs_data.database.Trip, stop_id: str, source: str, due: datetime.datetime, currentDateTime: datetime.datetime):
+    # A trip whose route_id isn't in routes.txt has no route; report it
+    # without one rather than dropping the trip.
+    route, route_type = None, None
+    if trip.route is not None:
+      route = trip.route['route_short_name']
+      route_type = gtfs_data.database.ROUTE_TYPES[trip.route['route_type']]
+
     return cls(
       trip_id=trip.trip_id,
-      route=trip.route['route_short_name'],
-      route_type=gtfs_data.database.ROUTE_TYPES[trip.route['route_type']],
+      route=route,
+      route_type=route_type,
       headsign=trip.trip_headsign,
       direction=trip.direction_id,
       stop_id=stop_id,
@@ -102,15 +121,27 @@ class Transit:
   def __init__(self, fetch_fn: Callable[[], bytes], db: gtfs_data.database.Database):
     self._fetch_fn = fetch_fn
     self._database = db
+    # The last (raw, parsed) feed. Callers only read the parsed message, so it
+    # can be shared; it's replaced, never modified.
+    self._last_feed : Tuple[bytes, Optional[gtfs_realtime_pb2.FeedMessage]] = (b'', None)
 
   def LoadFromAPI(self) -> gtfs_realtime_pb2.FeedMessage:
     raw = self._fetch_fn()
+
+    # The feed often hasn't changed since the last fetch (e.g. the fetcher got
+    # a 304 and returned its previous body). Comparing bytes is much cheaper
+    # than parsing them again.
+    last_raw, last_pb = self._last_feed
+    if last_pb is not None and raw == last_raw:
+      return last_pb
+
     ret = gtfs_realtime_pb2.FeedMessage()
     ret.ParseFromString(raw)
+    self._last_feed = (raw, ret)
     return ret
 
   @SCHEDULED_TIME.time()
-  def GetScheduled(self, interesting_stops: List[str]) -> List[Upcoming]:
+  def GetScheduled(self, interesting_stops: Sequence[str]) -> List[Upcoming]:
     start = now()
     end = now() + datetime.timedelta(minutes=120)
 
@@ -120,13 +151,7 @@ class Transit:
       trips = self._database.GetScheduledFor(stop_id, start, end)
 
       for t in trips:
-        due = ''
-
-        for s in t.stop_times:
-          if s['stop_id'] == stop_id:
-            due = parseTime(s['arrival_time'])
-            break
-
+        due = secondsToTime(arrivalAt(t.stop_times, stop_id))
         ret.append(Upcoming.FromTrip(t, stop_id, 'SCHEDULE', due, now()))
 
     SCHEDULED_RETURNED.observe(len(ret))
@@ -134,9 +159,11 @@ class Transit:
     return sorted(ret, key=lambda x: x.dueInSeconds)
 
   @LIVE_TIME.time()
-  def GetLive(self, interesting_stops: List[str]) -> List[Upcoming]:
+  def GetLive(self, interesting_stops: Sequence[str]) -> List[Upcoming]:
     resp = self.LoadFromAPI()
     ret = []
+    # Checked against every stop of every trip in the feed.
+    stops = frozenset(interesting_stops)
     early = 0
     delayed = 0
     ontime = 0
@@ -164,11 +191,13 @@ class Transit:
       sequence = -1
       arrival_time = datetime.datetime.fromtimestamp(1)
       stop_id = ""
-      for st in trip_from_db.stop_times:
-        if st['stop_id'] in interesting_stops:
-          stop_id = st['stop_id']
-          sequence = int(st['stop_sequence'])
-          arrival_time = parseTime(st['arrival_time'])
+      st = trip_from_db.stop_times
+      for i, sid in enumerate(st.stop_ids):
+        # Stops without a time (-1) aren't timepoints; look for one that is.
+        if sid in stops and st.arrival_seconds[i] >= 0:
+          stop_id = sid
+          sequence = st.stop_sequences[i]
+          arrival_time = secondsToTime(st.arrival_seconds[i])
           break
 
       updated_arrival_time = arrival_time
@@ -209,7 +238,7 @@ class Transit:
     return ret
 
   @UPCOMING_TIME.time()
-  def GetUpcoming(self, interesting_stops: List[str]) -> List[Upcoming]:
+  def GetUpcoming(self, interesting_stops: Sequence[str]) -> List[Upcoming]:
     ret : List[Upcoming] = []
 
     scheduled = self.GetScheduled(interesting_stops)
@@ -23,19 +23,30 @@ def fetch(input_file: str):
 
 class TestTransit(unittest.TestCase):
   def setUp(self):
-    database = gtfs_data.database.Database(GTFS_DATA, INTERESTING_STOPS)
-    database.Load()
+    self.database = gtfs_data.database.Database(GTFS_DATA, INTERESTING_STOPS)
+    self.database.Load()
 
     self.fetch_input = TEST_FEEDMESSAGE_TWO
-    self.transit = transit.Transit(self.fetch, database)
+    self.transit = transit.Transit(self.fetch, self.database)
 
   def fetch(self):
     """Simple wrapper to allow a test to specify which file it wants."""
     return fetch(self.fetch_input)
 
-  def testParseTime(self):
-    now = transit.now()
-    self.assertEqual(transit.parseTime("24:20:00").date() - now.date(), datetime.timedelta(days=1))
+  def testLoadFromAPIReusesUnchangedFeed(self):
+    first = self.transit.LoadFromAPI()
+    self.assertIs(self.transit.LoadFromAPI(), first)
+
+    self.fetch_input = TEST_FEEDMESSAGE_ONE
+    second = self.transit.LoadFromAPI()
+    self.assertIsNot(second, first)
+    self.assertEqual(len(second.entity), 1)
+
+  def testSecondsToTime(self):
+    with unittest.mock.patch('transit.now') as mock_now:
+      mock_now.return_value = datetime.datetime(2020, 11, 19, 7, 0, 0)
+      self.assertEqual(transit.secondsToTime(26416), datetime.datetime(2020, 11, 19, 7, 20, 16))
+      self.assertEqual(transit.secondsToTime(90000), datetime.datetime(2020, 11, 20, 1, 0, 0))
 
   def testDelta_Seconds(self):
     now = datetime.datetime(2023, 8, 21)
@@ -105,6 +116,45 @@ class TestTransit(unittest.TestCase):
         self.assertEqual(resp[0].dueTime, '08:04:11')
         self.assertEqual(resp[0].source, 'SCHEDULE')
 
+  def addUntimedVisit(self, trip_id: str):
+    """Has trip_id also pass the interesting stop earlier, with no arrival time."""
+    st = self.database.GetTrip(trip_id).stop_times
+    i = st.stop_ids.index(INTERESTING_STOPS[0]) - 5
+    st.stop_ids[i] = INTERESTING_STOPS[0]
+    st.arrival_seconds[i] = -1
+
+  def testGetLiveSkipsUntimedStop(self):
+    self.addUntimedVisit('1167')
+    with unittest.mock.patch('transit.now') as mock_now:
+        mock_now.return_value = datetime.datetime(2020, 8, 20, 7, 0, 0)
+
+        resp = self.transit.GetLive(INTERESTING_STOPS)
+        self.assertEqual(2, len(resp))
+        self.assertEqual(resp[0].route, '7A')
+        self.assertEqual(resp[0].dueTime, '07:24:16')
+
+  def testGetScheduledSkipsUntimedStop(self):
+    self.addUntimedVisit('1167')
+    with unittest.mock.patch('transit.now') as mock_now:
+        mock_now.return_value = datetime.datetime(2020, 11, 19, 7, 00, 0)
+
+        resp = self.transit.GetScheduled(INTERESTING_STOPS)
+        self.assertEqual(2, len(resp))
+        self.assertEqual(resp[0].route, '7A')
+        self.assertEqual(resp[0].dueTime, '07:20:16')
+
+  def testGetScheduledUnknownRoute(self):
+    self.database.GetTrip('1167').route = None
+    with unittest.mock.patch('transit.now') as mock_now:
+        mock_now.return_value = datetime.datetime(2020, 11, 19, 7, 00, 0)
+
+        resp = self.transit.GetScheduled(INTERESTING_STOPS)
+        self.assertEqual(2, len(resp))
+        self.assertEqual(resp[0].trip_id, '1167')
+        self.assertIsNone(resp[0].route)
+        self.assertIsNone(resp[0].route_type)
+        self.assertEqual(resp[1].route, '7')
+
   def testGetUpcoming(self):
     # Use only one trip; this means GetUpcoming will have to merge the live
     # and schedule.